@@ -58,8 +58,11 @@ class LaCTSWIGLUConfig(PretrainedConfig):
         tie_word_embeddings: bool = False,
         fuse_norm: bool = True,
         last_layer_fuse_norm: bool = True,
+        selective_checkpointing: bool = False, # if True, gradient checkpointing only recomputes the LaCT-SWIGLU layer of each block.
+        offload_hidden_states: bool = False, # if True, `output_hidden_states` are detached copies in pinned cpu memory.
         fuse_swiglu: bool = True,
         fuse_cross_entropy: bool = True,
+        labels_already_shifted: bool = False, # if True, the data pipeline already passes next-token labels.
         vocab_size: int = 32000,
         fw_init_gain: float = 0.5,
         **kwargs,
@@ -94,8 +97,11 @@ class LaCTSWIGLUConfig(PretrainedConfig):
 
         self.fuse_norm = fuse_norm
         self.last_layer_fuse_norm = last_layer_fuse_norm # seems that you need to set this to False to use activation checkpointing for every layer. 
+        self.selective_checkpointing = selective_checkpointing
+        self.offload_hidden_states = offload_hidden_states
         self.fuse_swiglu = fuse_swiglu
         self.fuse_cross_entropy = fuse_cross_entropy
+        self.labels_already_shifted = labels_already_shifted
         self.vocab_size = vocab_size
 
         self.use_momentum = use_momentum
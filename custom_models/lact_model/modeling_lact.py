@@ -20,7 +20,6 @@ from fla.models.utils import Cache
 from fla.modules import FusedCrossEntropyLoss, FusedLinearCrossEntropyLoss
 from fla.modules import GatedMLP as TransformerMLP
 from fla.modules import RMSNorm
-import torch.nn as nn
 
 from .layer_lact_swiglu import LaCTSWIGLULayer
 from .configuration_lact_swiglu import LaCTSWIGLUConfig
@@ -29,22 +28,26 @@ logger = logging.get_logger(__name__)
 
 if TYPE_CHECKING:
     from transformers.processing_utils import Unpack
+
+# the model runs in bf16, let the remaining fp32 matmuls (loss, init, norm reductions) use TF32 tensor cores
+if torch.cuda.is_available():
+    torch.set_float32_matmul_precision('high')
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
         
 
 class LaCTBlock(nn.Module):
-    def to_bfloat16(self):
-        """Recursively convert all parameters and buffers to bfloat16."""
-        for module in self.modules():
-            module.to(torch.bfloat16)
-        return self
-
     def __init__(self, config: LaCTSWIGLUConfig, layer_idx: int):
         super().__init__()
 
         self.config = config
         self.layer_idx = layer_idx
 
-        self.attn_norm = (RMSNorm if config.fuse_norm else nn.RMSNorm)(config.hidden_size, eps=config.norm_eps)
+        # the residual adds are always fused into the pre-norms, see `forward`
+        if not config.fuse_norm:
+            raise ValueError("`LaCTBlock` requires `fuse_norm=True` to fuse the residual adds into its RMSNorms.")
+
+        self.attn_norm = RMSNorm(config.hidden_size, eps=config.norm_eps)
         self.attn = LaCTSWIGLULayer(
             hidden_size=config.hidden_size,
             num_attn_heads=config.num_attn_heads,
@@ -70,7 +73,7 @@ class LaCTBlock(nn.Module):
             fw_init_gain=config.fw_init_gain
         )
 
-        self.mlp_norm = (RMSNorm if config.fuse_norm else nn.RMSNorm)(config.hidden_size, eps=config.norm_eps)
+        self.mlp_norm = RMSNorm(config.hidden_size, eps=config.norm_eps)
         self.mlp = TransformerMLP(
             hidden_size=config.hidden_size,
             hidden_ratio=config.hidden_ratio,
@@ -79,50 +82,105 @@ class LaCTBlock(nn.Module):
             fuse_swiglu=config.fuse_swiglu
         )
 
-        # Convert all weights and buffers to bfloat16
-        self.to_bfloat16()
+        # set by `gradient_checkpointing_enable`, only used with `config.selective_checkpointing`
+        self.gradient_checkpointing = False
 
     def forward(
         self,
         hidden_states: torch.Tensor,
+        residual: Optional[torch.Tensor] = None,
         attention_mask: Optional[torch.Tensor] = None,
-        past_key_values: Optional[Tuple[torch.Tensor]] = None,
         output_attentions: Optional[bool] = False,
-        use_cache: Optional[bool] = False,
+        output_hidden_states: Optional[bool] = False,
         **kwargs: Unpack[Any]
-    ) -> Tuple[torch.BFloat16Tensor, Optional[Tuple[torch.BFloat16Tensor, torch.BFloat16Tensor]]]:
-
-        # Ensure hidden_states and residual are bfloat16 for matmul compatibility
-        hidden_states = hidden_states.to(torch.bfloat16)
-        residual = hidden_states
-        hidden_states = self.attn_norm(hidden_states)
-        hidden_states, attentions, past_key_values = self.attn(
-            hidden_states=hidden_states,
-            attention_mask=attention_mask,
-            past_key_values=past_key_values,
-            use_cache=use_cache,
-            output_attentions=output_attentions,
-            **kwargs
-        )
-        if self.config.fuse_norm:
-            hidden_states, residual = self.mlp_norm(hidden_states, residual, True)
+    ) -> Tuple[torch.BFloat16Tensor, ...]:
+        # `hidden_states` is the un-added output of the previous block (or the embeddings if `residual` is None),
+        # the add into the residual stream is fused with the pre-norm and left to the next block / final norm.
+        hidden_states, residual = self.attn_norm(hidden_states, residual, True)
+        # the fused residual is this block's input stream, it is kept for backward anyway, so handing it out is free
+        block_input = residual
+        if self.gradient_checkpointing and self.training and self.config.selective_checkpointing:
+            # only recompute the attention layer, the norm/mlp activations are cheap to keep.
+            # always non-reentrant: reentrant checkpointing rejects the keyword arguments forwarded to the layer
+            hidden_states, attentions, _ = torch.utils.checkpoint.checkpoint(
+                self.attn.__call__,
+                hidden_states,
+                use_reentrant=False,
+                attention_mask=attention_mask,
+                output_attentions=output_attentions,
+                **kwargs
+            )
         else:
-            hidden_states = residual + hidden_states
-            residual = hidden_states
-            hidden_states = self.mlp_norm(hidden_states)
+            hidden_states, attentions, _ = self.attn(
+                hidden_states=hidden_states,
+                attention_mask=attention_mask,
+                output_attentions=output_attentions,
+                **kwargs
+            )
+        hidden_states, residual = self.mlp_norm(hidden_states, residual, True)
         hidden_states = self.mlp(hidden_states, **kwargs)
-        hidden_states = residual + hidden_states
-        hidden_states = hidden_states.to(torch.bfloat16)
 
-        outputs = (hidden_states,)
+        if output_attentions or output_hidden_states:
+            return hidden_states, residual, attentions, block_input if output_hidden_states else None
+        # the residual stream has to be handed to the next block, so the fast path returns a pair, not a bare tensor
+        return hidden_states, residual
 
-        if output_attentions:
-            outputs += (attentions,)
 
-        if use_cache:
-            outputs += (past_key_values,)
+def _init_linear(module: nn.Module, config: LaCTSWIGLUConfig):
+    # Slightly different from the TF version which uses truncated_normal for initialization
+    # cf https://github.com/pytorch/pytorch/pull/5617
+    nn.init.normal_(module.weight, mean=0.0, std=config.initializer_range)
+    if module.bias is not None:
+        nn.init.zeros_(module.bias)
+
+
+def _init_embedding(module: nn.Module, config: LaCTSWIGLUConfig):
+    nn.init.normal_(module.weight, mean=0.0, std=config.initializer_range)
+
+
+def _init_lact_layer(module: nn.Module, config: LaCTSWIGLUConfig):
+    #### Initialize the parameters of the model
+    nn.init.ones_(module.qk_scale)
+    nn.init.zeros_(module.qk_offset)
+
+    logger.info(f"in PreTrainedModel initialize fast weights for LaCTSWIGLULayer")
+    # init w0, w1, w2
+    if module.w0_w2_low_rank > 0:
+        module.w0._init_weights()
+        module.w2._init_weights()
+    else:
+        nn.init.normal_(module.w0, mean=0.0, std=1.0 / math.sqrt(module.fw_head_dim))
+        nn.init.normal_(module.w2, mean=0.0, std=1.0 / math.sqrt(module.fw_head_dim))
+
+    nn.init.normal_(module.w1, mean=0.0, std=1.0/math.sqrt(module.d_h))
+
+
+def _reset_parameters(module: nn.Module, config: LaCTSWIGLUConfig):
+    module.reset_parameters()
 
-        return outputs
+
+# exact module type -> init function, other types are resolved once by `_resolve_init_fn` and cached here
+_INIT_DISPATCH = {
+    nn.Linear: _init_linear,
+    nn.Conv1d: _init_linear,
+    nn.Embedding: _init_embedding,
+    LaCTSWIGLULayer: _init_lact_layer,
+}
+
+
+def _resolve_init_fn(module_type: type):
+    if issubclass(module_type, (nn.Linear, nn.Conv1d)):
+        init_fn = _init_linear
+    elif issubclass(module_type, nn.Embedding):
+        init_fn = _init_embedding
+    elif issubclass(module_type, LaCTSWIGLULayer):
+        init_fn = _init_lact_layer
+    elif hasattr(module_type, 'reset_parameters'):
+        init_fn = _reset_parameters
+    else:
+        init_fn = None
+    _INIT_DISPATCH[module_type] = init_fn
+    return init_fn
 
 
 class LaCTPreTrainedModel(PreTrainedModel):
@@ -136,22 +194,22 @@ class LaCTPreTrainedModel(PreTrainedModel):
     def __init__(self, *inputs, **kwargs):
         super().__init__(*inputs, **kwargs)
 
+    def gradient_checkpointing_enable(self, gradient_checkpointing_kwargs=None):
+        if gradient_checkpointing_kwargs is None:
+            # non-reentrant checkpointing accepts keyword arguments and composes with torch.compile
+            gradient_checkpointing_kwargs = {"use_reentrant": False}
+        super().gradient_checkpointing_enable(gradient_checkpointing_kwargs=gradient_checkpointing_kwargs)
+
     def _init_weights(
         self,
         module: nn.Module,
         rescale_prenorm_residual: bool = False,
         num_residuals_per_layer: int = 2,
     ):
-        if isinstance(module, (nn.Linear, nn.Conv1d)):
-            # Slightly different from the TF version which uses truncated_normal for initialization
-            # cf https://github.com/pytorch/pytorch/pull/5617
-            nn.init.normal_(module.weight, mean=0.0, std=self.config.initializer_range)
-            if module.bias is not None:
-                nn.init.zeros_(module.bias)
-        elif isinstance(module, nn.Embedding):
-            nn.init.normal_(module.weight, mean=0.0, std=self.config.initializer_range)
-        elif hasattr(module, 'reset_parameters'):
-            module.reset_parameters()
+        module_type = type(module)
+        init_fn = _INIT_DISPATCH[module_type] if module_type in _INIT_DISPATCH else _resolve_init_fn(module_type)
+        if init_fn is not None:
+            init_fn(module, self.config)
 
         if rescale_prenorm_residual:
             # Reinitialize selected weights subject to the OpenAI GPT-2 Paper Scheme:
@@ -170,36 +228,16 @@ class LaCTPreTrainedModel(PreTrainedModel):
                 # Following Pytorch init, except scale by 1/sqrt(2 * n_layer)
                 # We need to reinit p since this code could be called multiple times
                 # Having just p *= scale would repeatedly scale it down
-                nn.init.kaiming_uniform_(p, a=math.sqrt(5))
-                with torch.no_grad():
-                    p /= math.sqrt(num_residuals_per_layer * self.config.num_hidden_layers)
-        
-        if isinstance(module, LaCTSWIGLULayer):
-            #### Initialize the parameters of the model
-            nn.init.ones_(module.qk_scale)
-            nn.init.zeros_(module.qk_offset)
-
-            logger.info(f"in PreTrainedModel initialize fast weights for LaCTSWIGLULayer")
-            # init w0, w1, w2
-            if module.w0_w2_low_rank > 0:
-                module.w0._init_weights()
-                module.w2._init_weights()
-            else:
-                nn.init.normal_(module.w0, mean=0.0, std=1.0 / math.sqrt(module.fw_head_dim))
-                nn.init.normal_(module.w2, mean=0.0, std=1.0 / math.sqrt(module.fw_head_dim))
-
-        
-            nn.init.normal_(module.w1, mean=0.0, std=1.0/math.sqrt(module.d_h))
+                # kaiming_uniform_(p, a=sqrt(5)) samples from U(-1/sqrt(fan_in), 1/sqrt(fan_in)),
+                # so sample directly from the scaled bound instead of dividing p afterwards
+                fan_in, _ = nn.init._calculate_fan_in_and_fan_out(p)
+                scale = 1.0 / math.sqrt(num_residuals_per_layer * self.config.num_hidden_layers)
+                bound = scale / math.sqrt(fan_in)
+                nn.init.uniform_(p, -bound, bound)
 
 
 
 class LaCTModel(LaCTPreTrainedModel):
-    def to_bfloat16(self):
-        """Recursively convert all parameters and buffers to bfloat16."""
-        for module in self.modules():
-            module.to(torch.bfloat16)
-        return self
-
     def __init__(
         self,
         config: LaCTSWIGLUConfig
@@ -209,16 +247,33 @@ class LaCTModel(LaCTPreTrainedModel):
         self.vocab_size = config.vocab_size
 
         self.embeddings = nn.Embedding(config.vocab_size, config.hidden_size, self.padding_idx)
-        self.layers = nn.ModuleList([LaCTBlock(config, layer_idx) for layer_idx in range(config.num_hidden_layers)])
+        init_device = self.embeddings.weight.device
+        if init_device.type == 'meta':
+            # already under an empty-weights context (flame's meta init, `low_cpu_mem_usage`/`device_map`
+            # in `from_pretrained`), which decides where buffers live, so build the blocks as usual
+            self.layers = nn.ModuleList([LaCTBlock(config, layer_idx) for layer_idx in range(config.num_hidden_layers)])
+        else:
+            # build the blocks on the meta device so none of their weights are sampled here,
+            # they are materialized on the embeddings' device and initialized in place by `post_init`
+            with torch.device('meta'):
+                self.layers = nn.ModuleList([LaCTBlock(config, layer_idx) for layer_idx in range(config.num_hidden_layers)])
+            self.layers.to_empty(device=init_device)
+            # non-persistent buffers (e.g., rotary frequencies) are neither initialized by `post_init` under
+            # `from_pretrained` nor loaded from checkpoints, so recompute them right away
+            for module in self.layers.modules():
+                if module._non_persistent_buffers_set and hasattr(module, 'reset_parameters'):
+                    module.reset_parameters()
         # for flame, full act_ckpt will throw error if we fuse the last layer norm, 
         self.norm = (RMSNorm if config.last_layer_fuse_norm else nn.RMSNorm)(config.hidden_size, eps=config.norm_eps)
 
         self.gradient_checkpointing = False
+        # side streams for copying `output_hidden_states` to the cpu, one per cuda device, created on first use
+        self._offload_streams = {}
 
         self.post_init()
 
-        # Convert all weights and buffers to bfloat16
-        self.to_bfloat16()
+        # Convert all weights and buffers to bfloat16, `nn.Module.to` already recurses into every submodule
+        self.to(dtype=torch.bfloat16)
 
     def get_input_embeddings(self):
         return self.embeddings
@@ -226,6 +281,24 @@ class LaCTModel(LaCTPreTrainedModel):
     def set_input_embeddings(self, value):
         self.embeddings = value
 
+    def _collect_hidden_states(self, hidden_states: torch.Tensor) -> torch.Tensor:
+        if not (self.config.offload_hidden_states and hidden_states.is_cuda):
+            return hidden_states
+        # copy into pinned cpu memory on a side stream so the collected states are not kept alive on the gpu,
+        # the copies are detached, so this is meant for logging/analysis rather than losses on hidden states
+        # layers may be placed on different devices (e.g., `device_map`), so use the streams of the tensor's device
+        device = hidden_states.device
+        stream = self._offload_streams.get(device)
+        if stream is None:
+            stream = self._offload_streams[device] = torch.cuda.Stream(device=device)
+        stream.wait_stream(torch.cuda.current_stream(device))
+        cpu_tensor = torch.empty(hidden_states.shape, dtype=hidden_states.dtype, device='cpu', pin_memory=True)
+        with torch.cuda.stream(stream):
+            cpu_tensor.copy_(hidden_states.detach(), non_blocking=True)
+        # the gpu tensor may be freed before the copy is done, keep the caching allocator from reusing it
+        hidden_states.record_stream(stream)
+        return cpu_tensor
+
     def forward(
         self,
         input_ids: Optional[torch.LongTensor] = None,
@@ -245,7 +318,6 @@ class LaCTModel(LaCTPreTrainedModel):
             output_attentions = False
         output_attentions = output_attentions if output_attentions is not None else self.config.output_attentions
         output_hidden_states = output_hidden_states if output_hidden_states is not None else self.config.output_hidden_states
-        use_cache = use_cache if use_cache is not None else (self.config.use_cache if not self.training else False)
         return_dict = return_dict if return_dict is not None else self.config.use_return_dict
 
         # retrieve input_ids and inputs_embeds
@@ -254,72 +326,86 @@ class LaCTModel(LaCTPreTrainedModel):
         elif input_ids is None and inputs_embeds is None:
             raise ValueError("You have to specify either input_ids or inputs_embeds")
 
-        if use_cache and not isinstance(past_key_values, Cache):
-            past_key_values = Cache.from_legacy_cache(past_key_values)
+        # reintroduce the cache handling behind an explicit config flag once LaCT supports a kv cache
+        if use_cache:
+            logger.warning_once("`LaCTModel` does not support kv caching now, so `use_cache` is ignored.")
 
         if inputs_embeds is None:
             inputs_embeds = self.embeddings(input_ids)
+        elif inputs_embeds.dtype is not torch.bfloat16:
+            # the embedding table is already bf16, so only caller-provided embeddings may need a cast
+            inputs_embeds = inputs_embeds.to(torch.bfloat16)
 
         # embed positions
-        hidden_states = inputs_embeds.to(torch.bfloat16)
-
-        if self.gradient_checkpointing and self.training:
-            if use_cache:
-                logger.warning_once(
-                    "`use_cache=True` is incompatible with gradient checkpointing. Setting `use_cache=False`..."
-                )
-                use_cache = False
+        hidden_states = inputs_embeds
 
         all_hidden_states = () if output_hidden_states else None
         all_attns = () if output_attentions else None
-        next_cache = None
+        residual = None
 
-        for layer in self.layers:
-            if output_hidden_states:
-                all_hidden_states += (hidden_states,)
+        checkpoint_layers = self.gradient_checkpointing and self.training and not self.config.selective_checkpointing
+        # without full-block checkpointing the block hands out its fused pre-norm residual, which the norms keep anyway
+        return_block_input = output_hidden_states and not checkpoint_layers
 
-            if self.gradient_checkpointing and self.training:
+        for layer in self.layers:
+            if checkpoint_layers:
+                # checkpointing keeps only the block inputs alive, so feed a single materialized stream
+                # and collect that very tensor instead of having the checkpointed block return another one
+                if residual is not None:
+                    hidden_states, residual = residual + hidden_states, None
+                if output_hidden_states:
+                    all_hidden_states += (self._collect_hidden_states(hidden_states),)
                 layer_outputs = self._gradient_checkpointing_func(
                     layer.__call__,
                     hidden_states,
+                    residual,
                     attention_mask,
-                    past_key_values,
                     output_attentions,
-                    use_cache,
+                    False,
                     **kwargs
                 )
             else:
                 layer_outputs = layer(
                     hidden_states,
+                    residual=residual,
                     attention_mask=attention_mask,
-                    past_key_values=past_key_values,
                     output_attentions=output_attentions,
-                    use_cache=use_cache,
+                    output_hidden_states=return_block_input,
                     **kwargs
                 )
 
-            hidden_states = layer_outputs[0]
-            hidden_states = hidden_states.to(torch.bfloat16)
-
-            if use_cache:
-                next_cache = layer_outputs[2 if output_attentions else 1]
+            if output_attentions or return_block_input:
+                hidden_states, residual, attentions, block_input = layer_outputs
+                if output_attentions:
+                    all_attns += (attentions,)
+                if return_block_input:
+                    # the block input as computed by its fused pre-norm, instead of redoing `residual + hidden_states`
+                    all_hidden_states += (self._collect_hidden_states(block_input),)
+            else:
+                hidden_states, residual = layer_outputs
 
-            if output_attentions:
-                all_attns += (layer_outputs[1],)
+        # checked once after the loop instead of per layer, a dtype drift in any block propagates to the last output
+        torch._assert(hidden_states.dtype == torch.bfloat16, "LaCTBlock must keep hidden states in bfloat16")
 
-        hidden_states = self.norm(hidden_states)
-        hidden_states = hidden_states.to(torch.bfloat16)
+        # fuse the last residual add into the final norm whenever the fused norm is enabled
+        if self.config.last_layer_fuse_norm:
+            hidden_states = self.norm(hidden_states, residual)
+        else:
+            hidden_states = self.norm(residual + hidden_states)
 
         # add hidden states from the last decoder layer
         if output_hidden_states:
-            all_hidden_states += (hidden_states,)
+            all_hidden_states += (self._collect_hidden_states(hidden_states),)
+            # make sure all the cpu copies are complete before handing them out
+            for stream in self._offload_streams.values():
+                stream.synchronize()
 
         if not return_dict:
-            return tuple(v for v in [hidden_states, next_cache, all_hidden_states, all_attns] if v is not None)
+            return tuple(v for v in [hidden_states, all_hidden_states, all_attns] if v is not None)
 
         return BaseModelOutputWithPast(
             last_hidden_state=hidden_states,
-            past_key_values=next_cache,
+            past_key_values=None,
             hidden_states=all_hidden_states,
             attentions=all_attns
         )
@@ -335,6 +421,8 @@ class LaCTForCausalLM(LaCTPreTrainedModel, GenerationMixin):
         self.vocab_size = config.vocab_size
         self.lm_head = nn.Linear(config.hidden_size, config.vocab_size, bias=False)
         self.criterion = None
+        # loss modules built by `_get_criterion`
+        self._criteria = {}
 
         # Initialize weights and apply final processing
         self.post_init()
@@ -357,6 +445,21 @@ class LaCTForCausalLM(LaCTPreTrainedModel, GenerationMixin):
     def get_decoder(self):
         return self.model
 
+    def _get_criterion(self, training: bool, fuse_cross_entropy: bool) -> nn.Module:
+        # loss modules are built lazily and cached per (training, fuse_cross_entropy) mode,
+        # they are kept in a plain dict so they are not registered as submodules
+        key = (training, fuse_cross_entropy)
+        criterion = self._criteria.get(key)
+        if criterion is None:
+            if fuse_cross_entropy and training:
+                criterion = FusedLinearCrossEntropyLoss()
+            elif fuse_cross_entropy:
+                criterion = FusedCrossEntropyLoss(inplace_backward=True)
+            else:
+                criterion = nn.CrossEntropyLoss()
+            self._criteria[key] = criterion
+        return criterion
+
     @deprecate_kwarg("num_logits_to_keep", version="4.50", new_name="logits_to_keep")
     def prepare_inputs_for_generation(
         self,
@@ -365,20 +468,19 @@ class LaCTForCausalLM(LaCTPreTrainedModel, GenerationMixin):
         attention_mask: Optional[torch.Tensor] = None,
         inputs_embeds: Optional[torch.Tensor] = None,
         use_cache: bool = True,
-        logits_to_keep: Optional[int] = None,
+        logits_to_keep: Optional[int] = 1,
         **kwargs
     ):
+        # no kv cache is kept, so every step feeds the full `input_ids`
         use_cache = False
-        # only last token for `inputs_ids` if the `past_key_values` is not empty.
-        if past_key_values is not None and len(past_key_values) > 0 and use_cache:
-            input_ids = input_ids[:, -1:]
         # if `inputs_embeds` are passed, we only want to use them in the 1st generation step
-        if inputs_embeds is not None and len(past_key_values) == 0:
+        if inputs_embeds is not None and (past_key_values is None or len(past_key_values) == 0):
             model_inputs = {'inputs_embeds': inputs_embeds}
         else:
             # The `contiguous()` here is necessary to have a static stride during decoding. torchdynamo otherwise
             # recompiles graphs as the stride of the inputs is a guard.
             # Ref: https://github.com/huggingface/transformers/pull/29114
+            # `contiguous()` returns `input_ids` itself when it is already contiguous, so this only copies strided inputs.
             # TODO: use `next_tokens` directly instead.
             model_inputs = {'input_ids': input_ids.contiguous()}
 
@@ -427,25 +529,35 @@ class LaCTForCausalLM(LaCTPreTrainedModel, GenerationMixin):
         )
 
         hidden_states = outputs[0]
-        fuse_linear_and_cross_entropy = self.config.fuse_cross_entropy and self.training
-        logits = None if fuse_linear_and_cross_entropy else self.lm_head(hidden_states[:, -logits_to_keep:])
+        # read from the config on every step, it may be toggled after construction (e.g., for loss parallel)
+        fuse_cross_entropy = self.config.fuse_cross_entropy
+        fuse_linear_and_cross_entropy = fuse_cross_entropy and self.training
+        logits = None
+        if not fuse_linear_and_cross_entropy:
+            # `logits_to_keep=0` (or None) keeps all positions, `k > 0` only projects the last k tokens
+            kept_states = hidden_states[:, -logits_to_keep:].contiguous() if logits_to_keep else hidden_states
+            logits = self.lm_head(kept_states)
 
         loss = None
         if labels is not None:
-            if getattr(self, 'criterion', None) is None:
-                if fuse_linear_and_cross_entropy:
-                    criterion = FusedLinearCrossEntropyLoss()
-                elif self.config.fuse_cross_entropy:
-                    criterion = FusedCrossEntropyLoss(inplace_backward=True)
-                else:
-                    criterion = nn.CrossEntropyLoss()
-            else:
-                criterion = self.criterion
+            criterion = self.criterion
+            if criterion is None:
+                criterion = self._get_criterion(self.training, fuse_cross_entropy)
             # Enable model parallelism
             labels = labels.to(hidden_states.device)
-            labels = torch.cat((labels[..., 1:], torch.full_like(labels[:, :1], criterion.ignore_index)), 1)
+            if not self.config.labels_already_shifted:
+                # shift labels left by one into a single buffer instead of concatenating a padding column
+                shifted_labels = labels.new_empty(labels.shape)
+                shifted_labels[..., :-1].copy_(labels[..., 1:])
+                shifted_labels[..., -1:].fill_(criterion.ignore_index)
+                labels = shifted_labels
             if fuse_linear_and_cross_entropy:
-                loss = criterion(hidden_states.float(), labels, self.lm_head.weight.float(), self.lm_head.bias.float() if self.lm_head.bias is not None else None)
+                # `lm_head` is created without bias
+                # keep the fp32 master weight, cast once to the activation dtype, the kernel accumulates in fp32
+                loss = criterion(hidden_states, labels, self.lm_head.weight.to(hidden_states.dtype), None)
+            elif fuse_cross_entropy:
+                # `FusedCrossEntropyLoss` upcasts inside the kernel
+                loss = criterion(logits.view(labels.numel(), -1), labels.view(-1))
             else:
                 loss = criterion(logits.float().view(labels.numel(), -1), labels.view(-1))
 
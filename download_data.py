@@ -1,3 +1,5 @@
+import os
+
 from datasets import load_dataset, Value
 
 
@@ -16,9 +18,14 @@ print(first_few[0])
 """
 
 
-ds = load_dataset("Salesforce/wikitext", "wikitext-2-raw-v1", cache_dir=r"D:\Data")
-
-#d = load_dataset("karpathy/tiny_shakespeare", cache_dir=r"D:\Data", trust_remote_code=True)
+def main():
+    # materialize the arrow shards in parallel, the point of this script is to populate `cache_dir`,
+    # so the dataset is not streamed
+    ds = load_dataset("Salesforce/wikitext", "wikitext-2-raw-v1", cache_dir=r"D:\Data", num_proc=os.cpu_count())
 
+    #d = load_dataset("karpathy/tiny_shakespeare", cache_dir=r"D:\Data", trust_remote_code=True)
+    return ds
 
 
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,10 @@ import os
 api = HfApi(token=os.getenv(""))
 
 api = HfApi()
-api.upload_folder(
+# upload files with several workers and resumable commits instead of one synchronous commit
+api.upload_large_folder(
     repo_id="philippe-miranthis/testing-submit",
-    folder_path="exp/lact/lact-swa2048-rope-fw02-id-rank32-init0.5-gain0.5-nh4-momentum-140M-8K-B"
-)
\ No newline at end of file
+    folder_path="exp/lact/lact-swa2048-rope-fw02-id-rank32-init0.5-gain0.5-nh4-momentum-140M-8K-B",
+    repo_type="model",
+    num_workers=os.cpu_count()
+)